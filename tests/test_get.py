@@ -171,6 +171,11 @@ class GetTest(unittest.TestCase):
             f.seek(0)
             self.assertEqual(f.read(), open(os.path.join(os.path.dirname(__file__), 'test.file.gbk'), 'rb').read())
 
+        with urlfetch.get(testlib.url('utf8.txt')) as r:
+            chunks = list(r.iter_content(16))
+        self.assertTrue(all(len(chunk) <= 16 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), open(os.path.join(os.path.dirname(__file__), 'test.file'), 'rb').read())
+
     def test_compressed_streaming(self):
         sina = urlfetch.b('sina')
 
@@ -293,5 +298,36 @@ class GetTest(unittest.TestCase):
         self.assertTrue(isinstance(r.links, list))
         self.assertTrue(len(r.links) == 1)
 
+    def test_header_case(self):
+        r = urlfetch.get(testlib.url(), headers={'user-agent': 'mine'}, randua=True)
+        self.assertEqual(r.reqheaders['user-agent'], 'mine')
+        self.assertFalse('User-Agent' in r.reqheaders)
+
+    def test_dns_cache(self):
+        urlfetch.close_all()
+        urlfetch.DNS_CACHE.clear()
+        r = urlfetch.get(testlib.url())
+        self.assertEqual(r.status, 200)
+        self.assertEqual(len(urlfetch.DNS_CACHE), 1)
+        urlfetch.close_all()
+        # served from the cache on a new connection
+        r = urlfetch.get(testlib.url())
+        self.assertEqual(r.status, 200)
+        self.assertEqual(len(urlfetch.DNS_CACHE), 1)
+
+    def test_fetch_many(self):
+        urls = [testlib.url('?i=%d' % i) for i in range(8)]
+        urls.append(testlib.url('/redirect/1/0'))
+        responses = list(urlfetch.fetch_many(urls, max_workers=4,
+                                             max_redirects=1))
+        self.assertEqual(sorted(url for url, r in responses), sorted(urls))
+        for url, r in responses:
+            self.assertEqual(r.status, 200)
+            if 'redirect' in url:
+                self.assertEqual(r.url, testlib.url('/redirect/1/1'))
+            else:
+                self.assertEqual(r.url, url)
+            self.assertEqual(json.loads(r.text)['method'], 'GET')
+
 if __name__ == '__main__':
     unittest.main()
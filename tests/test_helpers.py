@@ -1,4 +1,5 @@
 #coding: utf8
+import sys
 import urlfetch
 import unittest
 
@@ -75,23 +76,221 @@ class HelpersTest(unittest.TestCase):
         self.assertEqual(parsed_url['password'], 'password')
         self.assertEqual(parsed_url['port'], None)
 
+        # IDNA hosts, twice to go through the cache
+        for i in range(2):
+            parsed_url = urlfetch.parse_url(u'http://\u4f8b\u3048.\u30c6\u30b9\u30c8:81/')
+            self.assertEqual(parsed_url['host'], 'xn--r8jz45g.xn--zckzah')
+            self.assertEqual(parsed_url['http_host'], 'xn--r8jz45g.xn--zckzah:81')
+
+        url = 'http://[::1]:8080/path'
+        parsed_url = urlfetch.parse_url(url)
+        self.assertEqual(parsed_url['host'], '::1')
+        self.assertEqual(parsed_url['port'], 8080)
+        self.assertEqual(parsed_url['http_host'], '[::1]:8080')
+        self.assertEqual(urlfetch.parse_url('http://[::1]/')['http_host'], '[::1]')
+
         url = 'http://www.example.com/?中国'
         self.assertEqual(not not urlfetch.parse_url(url), True)
         url = 'http://www.example.中国/?中国'
         self.assertEqual(not not urlfetch.parse_url(url), True)
 
+    def test_mb_code(self):
+        text = u'\u4e2d\u6587 text'
+        self.assertEqual(urlfetch.mb_code(text), text)
+        self.assertEqual(urlfetch.mb_code(text, 'utf-8'), text.encode('utf-8'))
+        for coding in ('utf-8', 'gb2312', 'gbk', 'gb18030'):
+            self.assertEqual(urlfetch.mb_code(text.encode(coding)), text)
+        for coding in ('utf-8-sig', 'utf-16', 'utf-32'):
+            self.assertEqual(urlfetch.mb_code(text.encode(coding)), text)
+        self.assertEqual(urlfetch.mb_code(b''), u'')
+        # gb2312 and gbk are decoded as gb18030, like browsers do
+        self.assertEqual(urlfetch.mb_code(b'\xa1\xa4'), u'\xb7')
+        # undecodable bytes are taken as latin-1
+        self.assertEqual(urlfetch.mb_code(b'\xff'), u'\xff')
+        self.assertEqual(urlfetch.mb_code(b'\xff', 'utf-8'), b'\xc3\xbf')
+        self.assertEqual(urlfetch.mb_code(b'\xff', 'ascii'), b'?')
+        self.assertRaises(LookupError, urlfetch.mb_code, b'abc', 'no-such-codec')
+
     def test_random_useragent(self):
         ua = urlfetch.random_useragent()
         self.assertTrue(isinstance(ua, urlfetch.basestring))
         self.assertTrue(len(ua) > 0)
         self.assertNotEqual(ua[0], '#')
 
+    def test_random_useragent_sticky(self):
+        import threading
+
+        ua = urlfetch.random_useragent(sticky=True)
+        for i in range(10):
+            self.assertEqual(urlfetch.random_useragent(sticky=True), ua)
+
+        uas = []
+        t = threading.Thread(
+            target=lambda: uas.append(urlfetch.random_useragent(False, True))
+        )
+        t.start()
+        t.join()
+        self.assertEqual(uas, ['urlfetch/%s' % urlfetch.__version__])
+        self.assertEqual(urlfetch.random_useragent(sticky=True), ua)
+
+        # picked once per file
+        self.assertEqual(urlfetch.random_useragent(False, True),
+                         'urlfetch/%s' % urlfetch.__version__)
+        self.assertEqual(urlfetch.random_useragent(sticky=True), ua)
+
+    def test_random_useragent_gzip(self):
+        import gzip
+        import os
+        import tempfile
+
+        fd, path = tempfile.mkstemp(suffix='.gz')
+        os.close(fd)
+        try:
+            with gzip.open(path, 'wb') as f:
+                f.write(b'# comment\nfoo/1.0\n\nfoo/1.0\n')
+            self.assertEqual(urlfetch.random_useragent(path), b'foo/1.0')
+        finally:
+            os.remove(path)
+
+    def test_random_useragent_file(self):
+        import os
+        import tempfile
+
+        uas = set(('Mozilla/5.0 (X11; Linux x86_64; rv:%d.0) Gecko/20100101 '
+                   'Firefox/%d.0' % (i, i)).encode('ascii') for i in range(40))
+        uas.add(b'foo/1.0')
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\n'.join(uas))
+        try:
+            picked = urlfetch.random_useragents(1000, path)
+            self.assertTrue(set(picked) <= uas)
+            self.assertTrue(len(set(picked)) > 1)
+        finally:
+            os.remove(path)
+
+    def test_useragents_table(self):
+        uas = [('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                '(KHTML, like Gecko) Chrome/%d.0 Safari/537.36' % i).encode('ascii')
+               for i in range(40)]
+        # entries are kept sorted, for front coding
+        uas.sort()
+        table = urlfetch._UserAgents(uas)
+        self.assertEqual(len(table), 40)
+        self.assertEqual(list(table), uas)
+        self.assertEqual(table[-1], uas[-1])
+        self.assertEqual(table[-40], uas[0])
+        self.assertRaises(IndexError, lambda: table[40])
+        self.assertRaises(IndexError, lambda: table[-41])
+
+    def test_random_useragents(self):
+        uas = urlfetch.random_useragents(10)
+        self.assertEqual(len(uas), 10)
+        for ua in uas:
+            self.assertTrue(isinstance(ua, bytes))
+            self.assertTrue(len(ua) > 0)
+
+        uas = urlfetch.random_useragents(3, False)
+        self.assertEqual(uas, ['urlfetch/%s' % urlfetch.__version__] * 3)
+
+    def test_random_useragent_family(self):
+        for i in range(20):
+            ua = urlfetch.random_useragent(family='Firefox')
+            self.assertTrue(b'Firefox/' in ua)
+            self.assertFalse(b'Chrome/' in ua)
+        for ua in urlfetch.random_useragents(20, family='Chrome'):
+            self.assertTrue(b'Chrome/' in ua)
+            self.assertFalse(b'Edg' in ua)
+        # unknown families fall back to any user-agent
+        self.assertTrue(urlfetch.random_useragent(family='Netscape'))
+
+    def test_random_useragent_sticky_family(self):
+        import threading
+
+        def pick():
+            for i in range(5):
+                firefox = urlfetch.random_useragent(sticky=True, family='Firefox')
+                chrome = urlfetch.random_useragent(sticky=True, family='Chrome')
+                picked.append((firefox, chrome))
+
+        # in a thread of its own, not to see picks of other tests
+        picked = []
+        t = threading.Thread(target=pick)
+        t.start()
+        t.join()
+        firefox, chrome = picked[0]
+        self.assertTrue(b'Firefox/' in firefox)
+        self.assertTrue(b'Chrome/' in chrome)
+        self.assertFalse(b'Firefox/' in chrome)
+        self.assertEqual(picked, [(firefox, chrome)] * 5)
+
     def test_choose_boundary(self):
         a = urlfetch.choose_boundary()
         b = urlfetch.choose_boundary()
         self.assertNotEqual(a, b)
         self.assertEqual(len(a), len(b))
 
+    def test_multipart_body(self):
+        import io
+        import tempfile
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'skipped' + b'x' * 100000)
+            f.seek(7)
+            body = urlfetch.MultipartBody(
+                {'a': 1}, {'f': ('f.bin', f), 't': ('t.txt', io.StringIO(u'\xe9'))}
+            )
+            # files are not read until iterated
+            self.assertEqual(f.tell(), 7)
+            value = body.getvalue()
+            # text files are encoded up front, so the length is known
+            self.assertEqual(len(value), body.length)
+
+        self.assertTrue(body.content_type.endswith(body.boundary))
+        self.assertEqual(value.count(b'--' + body.boundary.encode()), 4)
+        self.assertTrue(b'\r\n' + b'x' * 100000 + b'\r\n' in value)
+        self.assertFalse(b'skipped' in value)
+        self.assertTrue(b'\r\n\xc3\xa9\r\n' in value)
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'x' * 100000)
+            f.seek(0)
+            body = urlfetch.MultipartBody({}, {'f': ('f.bin', f)})
+            value = body.getvalue()
+            self.assertEqual(len(value), body.length)
+            self.assertTrue(body.rewindable)
+            self.assertEqual(b''.join(body), value)
+
+        value = urlfetch.MultipartBody(
+            {'a"\r\nb': [1, 2]}, {'f': ('x".txt', io.BytesIO(b'data'))}
+        ).getvalue()
+        self.assertEqual(value.count(b'name="a%22%0D%0Ab"\r\n'), 2)
+        self.assertTrue(b'name="f"; filename="x%22.txt"\r\n' in value)
+
+    def test_multipart_body_stream(self):
+        import os
+        r, w = os.pipe()
+        os.write(w, b'piped')
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            body = urlfetch.MultipartBody({}, {'f': ('f.bin', f)})
+            if sys.version_info < (3, 6):
+                # read up front, httplib can't send it chunked
+                self.assertEqual(body.length, len(body.getvalue()))
+                self.assertTrue(body.rewindable)
+            else:
+                # pipes can't tell their size, nor be read twice
+                self.assertEqual(body.length, None)
+                self.assertFalse(body.rewindable)
+            self.assertTrue(b'\r\npiped\r\n' in body.getvalue())
+
+    def test_multipart_body_short_read(self):
+        import io
+        f = io.BytesIO(b'content')
+        body = urlfetch.MultipartBody({}, {'f': ('f.bin', f)})
+        f.truncate(3)
+        self.assertRaises(urlfetch.UrlfetchException, body.getvalue)
+
     def test_url_concat(self):
         self.assertEqual(urlfetch.url_concat("foo?a=b", dict(c="d")), 'foo?a=b&c=d')
         self.assertEqual(urlfetch.url_concat("foo?c=b", dict(c="d"), keep_existing=True), 'foo?c=b&c=d')
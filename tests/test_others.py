@@ -1,8 +1,30 @@
 #coding: utf8
+import io
 import urlfetch
 import unittest
 
 
+class FakeResponse(object):
+    msg = status = reason = version = length = None
+
+    def __init__(self, headers, body=b''):
+        self.headers = headers
+        self.fp = io.BytesIO(body)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def getheaders(self):
+        return list(self.headers.items())
+
+    def read(self, amt=None):
+        # like httplib, nothing more to read once closed
+        return self.fp.read(amt) if self.fp else b''
+
+    def close(self):
+        self.fp = None
+
+
 class OthersTest(unittest.TestCase):
 
     def test_module_has_methods(self):
@@ -11,6 +33,68 @@ class OthersTest(unittest.TestCase):
             self.assertTrue(hasattr(urlfetch, method))
             self.assertTrue(callable(getattr(urlfetch, method)))
 
+    def test_session_useragent(self):
+        s = urlfetch.Session(headers={'user-agent': 'mine'}, randua=True)
+        self.assertEqual(s.headers, {'user-agent': 'mine'})
+
+    def test_response_cookies(self):
+        def cookies(setcookie):
+            r = FakeResponse({'set-cookie': setcookie})
+            return urlfetch.Response(r).cookies
+
+        self.assertEqual(cookies(None), {})
+        self.assertEqual(cookies('a=1; Path=/; HttpOnly'), {'a': '1'})
+        self.assertEqual(
+            cookies('sid=abc; Expires=Wed, 21 Oct 2015 07:28:00 GMT; Path=/, '
+                    'b=2 ; Max-Age=0, c=; Secure'),
+            {'sid': 'abc', 'b': '2', 'c': ''}
+        )
+        self.assertEqual(cookies('a="x y"; Path=/'), {'a': 'x y'})
+        self.assertEqual(cookies('a=1,2; Path=/'), {'a': '1,2'})
+        self.assertEqual(cookies('a=1,2, b=3'), {'a': '1,2', 'b': '3'})
+
+    def test_response_text(self):
+        def text(body, content_type=None):
+            r = FakeResponse({'content-type': content_type}, body)
+            return urlfetch.Response(r).text
+
+        s = u'\u4e2d\u6587 text'
+        self.assertEqual(text(s.encode('utf-8')), s)
+        self.assertEqual(text(s.encode('gbk'), 'text/plain; charset=GBK'), s)
+        self.assertEqual(text(s.encode('big5'), 'text/html;charset="big5"'), s)
+        # BOM wins over charset
+        self.assertEqual(text(s.encode('utf-16'), 'text/plain; charset=big5'), s)
+        # unknown or wrong charset, guessed
+        self.assertEqual(text(s.encode('utf-8'), 'text/plain; charset=x-foo'), s)
+        self.assertEqual(text(s.encode('utf-8'), 'text/plain; charset=ascii'), s)
+        self.assertEqual(text(b'caf\xe9', 'text/plain; charset=latin-1'), u'caf\xe9')
+
+    def test_response_content_encoding(self):
+        import gzip
+        data = b'urlfetch ' * 100
+        compressed = gzip.compress(data)
+
+        def body(content_encoding, payload, **kwargs):
+            r = FakeResponse({'content-encoding': content_encoding}, payload)
+            return urlfetch.Response(r, **kwargs).body
+
+        self.assertEqual(body('gzip', compressed), data)
+        self.assertEqual(body('GZIP', compressed), data)
+        self.assertEqual(body('identity', data), data)
+        self.assertEqual(body('gzip', compressed, decode_content=False), compressed)
+        self.assertRaises(urlfetch.ContentDecodingError, body, 'br', data)
+
+    def test_response_iter_content(self):
+        r = urlfetch.Response(FakeResponse({}, b'x' * 100))
+        self.assertEqual([len(c) for c in r.iter_content(40)], [40, 40, 20])
+        # a one-off size, later iterations read in the default one
+        self.assertEqual(r.chunk_size, 65536)
+
+        r = urlfetch.Response(FakeResponse({}, b'x' * 100))
+        chunks = r.iter_content(30)
+        self.assertEqual(len(next(chunks)), 30)
+        self.assertEqual([len(c) for c in r], [70])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import unittest
+import socketserver
+import http.server
+
+import urlfetch
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        self.served = 0
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.served >= self.server.max_requests:
+            # gone stale: dropped without a response, like a server closing
+            # a connection idle for long just as it is reused
+            self.close_connection = True
+            return
+        self.served += 1
+        body = self.command.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    connections = 0
+    max_requests = 100
+
+
+class PoolTest(unittest.TestCase):
+
+    def setUp(self):
+        urlfetch.close_all()
+        self.server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        urlfetch.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        r = urlfetch.get(self.url, timeout=5)
+        conn = r._connection[1]
+        self.assertEqual(r.body, b'GET')
+        self.assertEqual(len(urlfetch.CONNECTION_POOL), 1)
+
+        r = urlfetch.get(self.url, timeout=3)
+        self.assertTrue(r._connection[1] is conn)
+        self.assertEqual(conn.sock.gettimeout(), 3)
+        self.assertEqual(r.body, b'GET')
+        self.assertEqual(self.server.connections, 1)
+
+        urlfetch.close_all()
+        self.assertEqual(urlfetch.CONNECTION_POOL, {})
+
+    def test_max_hosts(self):
+        max_hosts = urlfetch.POOL_MAX_HOSTS
+        urlfetch.POOL_MAX_HOSTS = 1
+        try:
+            urlfetch.get(self.url).body
+            url = self.url.replace('127.0.0.1', 'localhost')
+            urlfetch.get(url).body
+            self.assertEqual(len(urlfetch.CONNECTION_POOL), 1)
+            self.assertEqual(list(urlfetch.CONNECTION_POOL)[0][1],
+                             'localhost')
+        finally:
+            urlfetch.POOL_MAX_HOSTS = max_hosts
+
+    def test_stale_connection_retry(self):
+        self.server.max_requests = 1
+        self.assertEqual(urlfetch.get(self.url).body, b'GET')
+        # sent again on a new connection
+        self.assertEqual(urlfetch.get(self.url).body, b'GET')
+        self.assertEqual(self.server.connections, 2)
+
+        urlfetch.close_all()
+        self.assertEqual(urlfetch.post(self.url, data='a=1').body, b'POST')
+        # may have been handled already, not sent twice
+        self.assertRaises(urlfetch.UrlfetchException, urlfetch.post, self.url, data='a=1')
+        self.assertEqual(self.server.connections, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
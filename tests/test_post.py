@@ -38,6 +38,16 @@ class PostTest(unittest.TestCase):
         self.assertEqual(o['method'], 'POST')
         self.assertEqual(o['post'], d)
 
+    def test_post_content_type(self):
+        data = json.dumps(testlib.randdict()).encode('utf-8')
+        headers = {'content-type': 'application/json'}
+
+        r = urlfetch.post(testlib.test_server_host, data=data, headers=headers)
+        o = json.loads(r.text)
+
+        self.assertEqual(r.status, 200)
+        self.assertEqual(o['headers']['Content-Type'], 'application/json')
+
     def test_post_query_string(self):
         d = testlib.randdict()
         data = urlfetch.urlencode(d)
@@ -168,6 +178,22 @@ class PostTest(unittest.TestCase):
             self.assertEqual(o['files'][i][1].encode('gbk'), files[i][1])
             self.assertEqual(o['files'][i][2].encode('gbk'), md5sum(files[i][2]))
 
+    def test_streamed_upload_redirect(self):
+        r, w = os.pipe()
+        os.write(w, b'streamed')
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            r = urlfetch.post(testlib.url('/redirect/1/0'),
+                              files={'f': ('f', f)}, max_redirects=1)
+        o = json.loads(r.text)
+
+        # 303 See Other, followed with a GET without the body
+        self.assertEqual(r.status, 200)
+        self.assertEqual(o['method'], 'GET')
+        self.assertFalse('Content-Type' in o['headers'])
+        self.assertFalse(
+            any(k.lower() == 'content-type' for k in r.reqheaders))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -34,6 +34,14 @@ class GetTest(unittest.TestCase):
         s.popcookie(cookie[0])
         self.assertEqual(s.snapshot(), {'headers': headers, 'cookies': cookies})
 
+        s = urlfetch.Session(randua=True)
+        ua = s.headers['User-Agent']
+        self.assertTrue(isinstance(ua, urlfetch.basestring))
+        r = s.get(testlib.url())
+        self.assertEqual(r.reqheaders['User-Agent'], ua)
+        r = s.get(testlib.url())
+        self.assertEqual(r.reqheaders['User-Agent'], ua)
+
         s = urlfetch.Session()
         cookie = (randstr(), randstr())
         r = s.get(testlib.url('setcookie/%s/%s' % cookie))
@@ -16,11 +16,18 @@ __url__ = "https://github.com/ifduyue/urlfetch"
 __license__ = "BSD 2-Clause License"
 
 import zlib
-import os, sys, base64, codecs, uuid, stat, time, socket
+import gzip
+import select
+import os, sys, base64, codecs, stat, time, socket
+import threading
+import random
 import ssl
 from os.path import basename, dirname, abspath, join as pathjoin
-from functools import partial
-from io import BytesIO
+from functools import partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from collections import OrderedDict
+from array import array
 import re
 
 try:
@@ -28,7 +35,7 @@ try:
 except ImportError:
     import json
 
-from http.client import HTTPConnection, HTTPSConnection
+from http.client import HTTPConnection, HTTPSConnection, BadStatusLine
 from urllib.parse import parse_qs, urlencode, urlsplit, urljoin
 import http.cookies as Cookie
 
@@ -39,6 +46,7 @@ u = lambda s: s
 __all__ = (
     "request",
     "fetch",
+    "fetch_many",
     "Session",
     "get",
     "head",
@@ -95,12 +103,16 @@ class cached_property(object):
     A property that is only computed once per instance and then replaces
     itself with an ordinary attribute. Deleting the attribute resets the
     property.
+
+    Unless a setter or a deleter is given, it's a non-data descriptor: once
+    computed, the value is found in the instance ``__dict__`` without
+    calling into the descriptor at all.
     """
 
     def __init__(self, fget, fset=None, fdel=None, doc=None):
-        self.__get = fget
-        self.__set = fset
-        self.__del = fdel
+        self._get = fget
+        self._set = fset
+        self._del = fdel
         self.__doc__ = doc or fget.__doc__
         self.__name__ = fget.__name__
         self.__module__ = fget.__module__
@@ -112,14 +124,24 @@ class cached_property(object):
         try:
             return instance.__dict__[self.__name__]
         except KeyError:
-            value = instance.__dict__[self.__name__] = self.__get(instance)
+            value = instance.__dict__[self.__name__] = self._get(instance)
             return value
 
+    def setter(self, fset):
+        return _data_cached_property(self._get, fset, self._del)
+
+    def deleter(self, fdel):
+        return _data_cached_property(self._get, self._set, fdel)
+
+
+class _data_cached_property(cached_property):
+    """A :class:`cached_property` with a setter or a deleter."""
+
     def __set__(self, instance, value):
         if instance is None:
             return self
-        if self.__set is not None:
-            value = self.__set(instance, value)
+        if self._set is not None:
+            value = self._set(instance, value)
         instance.__dict__[self.__name__] = value
 
     def __delete__(self, instance):
@@ -130,14 +152,8 @@ class cached_property(object):
         except KeyError:
             pass
         else:
-            if self.__del is not None:
-                self.__del(instance, value)
-
-    def setter(self, fset):
-        return self.__class__(self.__get, fset, self.__del)
-
-    def deleter(self, fdel):
-        return self.__class__(self.__get, self.__set, fdel)
+            if self._del is not None:
+                self._del(instance, value)
 
 
 ##############################################################################
@@ -192,6 +208,16 @@ class Response(object):
     :raises: :class:`ContentLimitExceeded`
     """
 
+    # (pool key, httplib connection) the response is read from
+    _connection = None
+
+    #: Size of chunks read from the socket when iterating over the response.
+    chunk_size = 65536
+
+    #: If ``False``, gzip or deflate compressed bodies are returned as they
+    #: are, without being decompressed.
+    decode_content = True
+
     def __init__(self, r, **kwargs):
 
         for k in kwargs:
@@ -219,7 +245,15 @@ class Response(object):
         self.getheader = r.getheader
         self.getheaders = r.getheaders
 
-        self._content_encoding = self.getheader("content-encoding", None)
+        content_encoding = None
+        if self.decode_content:
+            content_encoding = self.getheader("content-encoding", None)
+        if content_encoding:
+            content_encoding = content_encoding.strip().lower()
+        # identity means no encoding at all
+        if content_encoding == "identity":
+            content_encoding = None
+        self._content_encoding = content_encoding
         self._decoder = None
 
         try:
@@ -245,9 +279,33 @@ class Response(object):
     def __iter__(self):
         return self
 
+    def iter_content(self, chunk_size=65536):
+        """Iterate over the (decompressed) response body in chunks, without
+        loading all of it into memory.
+
+        :arg int chunk_size: size of chunks read from the socket, default is
+                             65536, i.e. 64KiB.
+        """
+        while True:
+            try:
+                chunk = self._next_chunk(chunk_size)
+            except StopIteration:
+                return
+            yield chunk
+
     def __next__(self):
-        chunk = self.read()
+        return self._next_chunk(self.chunk_size)
+
+    def _next_chunk(self, chunk_size):
+        """Returns the next decompressed chunk of the body, read in
+        ``chunk_size`` bytes from the socket.
+
+        :raises: :class:`StopIteration` at the end of the body
+        """
+        chunk = self.read(chunk_size)
         if not chunk:
+            # hand the connection back as early as possible
+            self.close()
             if self._decoder:
                 chunk = self._decoder.flush()
                 self._decoder = None
@@ -300,16 +358,19 @@ class Response(object):
         """
         content = []
         length = 0
+        limit = self.length_limit
         for chunk in self:
-            content.append(chunk)
             length += len(chunk)
-            if self.length_limit and length > self.length_limit:
+            # checked before keeping the chunk, so no more than limit bytes
+            # are ever held
+            if limit and length > limit:
                 self.close()
                 raise ContentLimitExceeded(
-                    "Content length is more than %d " "bytes" % self.length_limit
+                    "Content length is more than %d " "bytes" % limit
                 )
+            content.append(chunk)
 
-        return b("").join(content)
+        return b"".join(content)
 
     # compatible with requests
     #: An alias of :attr:`body`.
@@ -319,8 +380,20 @@ class Response(object):
 
     @cached_property
     def text(self):
-        """Response body in str."""
-        return mb_code(self.content)
+        """Response body in str.
+
+        Decoded with the charset given in ``Content-Type``, unless the body
+        starts with a BOM or doesn't decode with it, then the encoding is
+        guessed by :func:`mb_code`.
+        """
+        content = self.content
+        m = CHARSET_REGEX.search(self.getheader("content-type", None) or "")
+        if m and not content.startswith(tuple(bom for bom, _ in BOMS)):
+            try:
+                return content.decode(m.group(1))
+            except (LookupError, UnicodeDecodeError):
+                pass
+        return mb_code(content)
 
     @cached_property
     def json(self):
@@ -329,7 +402,13 @@ class Response(object):
         :raises: :class:`ContentDecodingError`
         """
         try:
-            return json.loads(self.text)
+            try:
+                # json detects utf-8, utf-16 and utf-32 by itself, without
+                # building and keeping :attr:`text`
+                return json.loads(self.content)
+            except (TypeError, UnicodeDecodeError):
+                # other encodings, or a json without bytes support
+                return json.loads(self.text)
         except Exception as e:
             raise ContentDecodingError(e)
 
@@ -356,13 +435,17 @@ class Response(object):
             'x-cache-lookup': 'MISS from localhost:8080'
         }
         """
-        return dict((k.lower(), v) for k, v in self.getheaders())
+        return {k.lower(): v for k, v in self.getheaders()}
 
     @cached_property
     def cookies(self):
         """Cookies in dict"""
-        c = Cookie.SimpleCookie(self.getheader("set-cookie"))
-        return dict((i.key, i.value) for i in c.values())
+        setcookie = self.getheader("set-cookie")
+        if setcookie and '"' in setcookie:
+            # quoted values need the full parser
+            c = Cookie.SimpleCookie(setcookie)
+            return {i.key: i.value for i in c.values()}
+        return {k: v.strip() for k, v in SET_COOKIE_REGEX.findall(setcookie or "")}
 
     @cached_property
     def cookiestring(self):
@@ -393,11 +476,29 @@ class Response(object):
         return ret
 
     def close(self):
-        """Close the connection."""
-        self._r.close()
+        """Close the connection.
+
+        If the body was read to the end, the connection is kept open in a
+        pool instead, for later requests to the same host.
+        """
+        r = self._r
+        # nothing left unread on the connection
+        complete = r.fp is None or r.length == 0
+        r.close()
+        connection, self._connection = self._connection, None
+        if connection:
+            key, conn = connection
+            if complete:
+                _pool_put(key, conn)
+            else:
+                conn.close()
 
     def __del__(self):
-        self.close()
+        try:
+            self.close()
+        except Exception:
+            # module globals may be gone at interpreter exit
+            pass
 
 
 class Session(object):
@@ -413,9 +514,12 @@ class Session(object):
     :arg dict headers: Init headers.
     :arg dict cookies: Init cookies.
     :arg tuple auth: (username, password) for basic authentication.
+    :arg randua: (optional) If ``True`` or ``path string``, a random
+                 user-agent is picked once and sent with every request
+                 issued by this session.
     """
 
-    def __init__(self, headers={}, cookies={}, auth=None):
+    def __init__(self, headers={}, cookies={}, auth=None, randua=False):
         """Init a :class:`~urlfetch.Session` object"""
         #: headers
         self.headers = headers.copy()
@@ -424,8 +528,10 @@ class Session(object):
 
         if auth and isinstance(auth, (list, tuple)):
             auth = "%s:%s" % tuple(auth)
-            auth = base64.b64encode(auth.encode("utf-8"))
-            self.headers["Authorization"] = "Basic " + auth.decode("utf-8")
+            self.headers["Authorization"] = _basic_auth(auth)
+
+        if randua and not any(k.lower() == "user-agent" for k in self.headers):
+            self.headers["User-Agent"] = random_useragent(randua)
 
     def putheader(self, header, value):
         """Add an header to default headers."""
@@ -546,6 +652,38 @@ def fetch(*args, **kwargs):
     return get(*args, **kwargs)
 
 
+def fetch_many(urls, max_workers=16, **kwargs):
+    """Fetch URLs concurrently, in a pool of threads.
+
+    Each URL is fetched by :func:`~urlfetch.fetch` with ``kwargs``, and its
+    body is read in the worker thread, so downloads overlap too. Requests
+    to the same host share the idle connections of the connection pool.
+
+    :arg urls: URLs to be fetched.
+    :arg int max_workers: (optional) Max number of concurrent requests.
+    :returns: An iterator of ``(url, response)`` pairs, ``url`` as given in
+              ``urls`` and ``response`` a :class:`~urlfetch.Response`, in
+              the order they complete rather than the order of ``urls``.
+              A redirected response's ``url`` is where it ended up.
+    :raises: The first exception raised by a request, the ones not yet
+             started are cancelled.
+    """
+
+    def fetch_body(url):
+        response = fetch(url, **kwargs)
+        response.body
+        return response
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(fetch_body, url): url for url in urls}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
 def match_no_proxy(host, no_proxy):
     ip_regex = r"(\d{1,3}).(\d{1,3}).(\d{1,3}).(\d{1,3})"
     no_proxy_ip_regex = r"(\d{1,3}).(\d{1,3}).(\d{1,3}).(\d{1,3})(?=/(\d+))?"
@@ -568,6 +706,188 @@ def match_no_proxy(host, no_proxy):
         return host.endswith(no_proxy)
 
 
+def _ssl_context(verify=True):
+    """Returns the SSL context shared by HTTPS connections, :data:`SSL_CONTEXT`
+    or an unverified one, creating it on first use.
+
+    Creating a context loads the CA certificates, which is much slower than
+    most requests are.
+    """
+    global SSL_CONTEXT, UNVERIFIED_SSL_CONTEXT
+    if not verify:
+        if UNVERIFIED_SSL_CONTEXT is None:
+            UNVERIFIED_SSL_CONTEXT = ssl._create_unverified_context()
+        return UNVERIFIED_SSL_CONTEXT
+    if SSL_CONTEXT is None:
+        context = ssl._create_default_https_context()
+        if getattr(ssl, "HAS_ALPN", False):
+            # as httplib does for the contexts it creates itself
+            context.set_alpn_protocols(["http/1.1"])
+        SSL_CONTEXT = context
+    return SSL_CONTEXT
+
+
+def _getaddrinfo(host, port):
+    """Returns :func:`socket.getaddrinfo` results for TCP connections to
+    ``host`` and ``port``, cached for :data:`DNS_CACHE_TTL` seconds."""
+    key = (host, port)
+    now = time.monotonic()
+    cached = DNS_CACHE.get(key)
+    if cached is not None and now - cached[0] < DNS_CACHE_TTL:
+        return cached[1]
+
+    addrs = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    if DNS_CACHE_TTL > 0:
+        if len(DNS_CACHE) >= DNS_CACHE_MAXSIZE:
+            DNS_CACHE.clear()
+        DNS_CACHE[key] = (now, addrs)
+    return addrs
+
+
+def _create_connection(
+    address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None
+):
+    """:func:`socket.create_connection` for httplib connections, with
+    addresses resolved through :func:`_getaddrinfo`, and the socket options
+    wanted for small requests over pooled connections."""
+    host, port = address
+    err = None
+    for af, socktype, proto, _, sa in _getaddrinfo(host, port):
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sa)
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+            continue
+
+        try:
+            # httplib only sets it itself since Python 3.7
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # notice peers gone away while the connection sits in the pool
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except (OSError, AttributeError):
+            pass
+        return sock
+
+    # the host may have moved, resolve it again next time
+    DNS_CACHE.pop((host, port), None)
+    if err is not None:
+        raise err
+    raise OSError("getaddrinfo returns an empty list")
+
+
+def _pool_get(key, timeout):
+    """Returns an idle connection for ``key`` from the pool, set to
+    ``timeout``, or ``None``."""
+    while True:
+        with POOL_LOCK:
+            conns = CONNECTION_POOL.get(key)
+            if not conns:
+                return None
+            idle_since, conn = conns.pop()
+            if not conns:
+                del CONNECTION_POOL[key]
+        # servers close connections idle for long, often after 5 seconds,
+        # an idle connection with something to read has been closed or
+        # broken by the server already
+        try:
+            dropped = (
+                time.monotonic() - idle_since > POOL_IDLE_TIMEOUT
+                or conn.sock is None
+                or select.select([conn.sock], [], [], 0)[0]
+            )
+        except (OSError, ValueError):
+            dropped = True
+        if not dropped:
+            # the timeout of this request, not of the one that made it
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            return conn
+        conn.close()
+
+
+def _pool_put(key, conn):
+    """Puts an idle connection back into the pool, or closes it if the pool
+    for ``key`` is full or the connection can't be reused.
+
+    Connections idle for more than :data:`POOL_IDLE_TIMEOUT` are closed on
+    the way, whatever their host, and the least recently used host is
+    evicted when there are more than :data:`POOL_MAX_HOSTS`.
+    """
+    if key is None or conn.sock is None:
+        conn.close()
+        return
+
+    now = time.monotonic()
+    closing = []
+    with POOL_LOCK:
+        for k in list(CONNECTION_POOL):
+            conns = CONNECTION_POOL[k]
+            # oldest first, they are appended as they go idle
+            while conns and now - conns[0][0] > POOL_IDLE_TIMEOUT:
+                closing.append(conns.pop(0)[1])
+            if not conns:
+                del CONNECTION_POOL[k]
+
+        conns = CONNECTION_POOL.pop(key, [])
+        # most recently used last
+        CONNECTION_POOL[key] = conns
+        if len(conns) < POOL_MAXSIZE:
+            conns.append((now, conn))
+        else:
+            closing.append(conn)
+        while len(CONNECTION_POOL) > POOL_MAX_HOSTS:
+            closing.extend(c for _, c in CONNECTION_POOL.popitem(last=False)[1])
+
+    for conn in closing:
+        conn.close()
+
+
+def _pool_after_fork():
+    """Forget connections inherited from the parent process, they must not
+    be shared with it."""
+    global POOL_LOCK
+    POOL_LOCK = threading.Lock()
+    CONNECTION_POOL.clear()
+
+
+def close_all():
+    """Close all idle connections kept for reuse."""
+    with POOL_LOCK:
+        pools = list(CONNECTION_POOL.values())
+        CONNECTION_POOL.clear()
+    for conns in pools:
+        for idle_since, conn in conns:
+            conn.close()
+
+
+def _rewindable(data):
+    """Whether request body ``data`` can be sent again, on a new connection or
+    after a redirect. File objects and iterators are consumed when sent."""
+    return (
+        data is None
+        or isinstance(data, (basestring, bytearray))
+        or isinstance(data, MultipartBody) and data.rewindable
+    )
+
+
+@lru_cache(maxsize=128)
+def _basic_auth(credentials):
+    """Returns the value of a Basic authorization header for ``credentials``,
+    ``"username:password"``, cached as the same credentials are usually sent
+    over and over."""
+    return "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+
 def request(
     url,
     method="GET",
@@ -584,6 +904,7 @@ def request(
     max_redirects=0,
     source_address=None,
     validate_certificate=None,
+    decode_content=True,
     **kwargs
 ):
     """request an URL
@@ -617,32 +938,73 @@ def request(
                                to 2.7/3.2.
     :arg bool validate_certificate: (optional) If ``False``, urlfetch skips
                                 all the necessary certificate and hostname checks
+    :arg bool decode_content: (optional) If ``False``, gzip or deflate
+                              compressed response bodies are not
+                              decompressed.
     :returns: A :class:`~urlfetch.Response` object
     :raises: :class:`URLError`, :class:`UrlfetchException`,
              :class:`TooManyRedirects`,
     """
 
     def make_connection(conn_type, host, port, timeout, source_address):
-        """Return HTTP or HTTPS connection."""
-        kwargs = {"timeout": timeout, "source_address": source_address}
+        """Return pool key and HTTP or HTTPS connection, an idle one from the
+        pool if any."""
+        if conn_type == "https":
+            ssl_context = _ssl_context(validate_certificate is not False)
+        elif conn_type == "http":
+            ssl_context = None
+        else:
+            raise URLError("Unknown Connection Type: %s" % conn_type)
 
-        ssl_context = None
-        if validate_certificate is False:
-            ssl_context = ssl._create_unverified_context()
+        if source_address:
+            # bound to a local address of the caller's choice, not shared
+            key = None
+        else:
+            # connections made with a replaced SSL_CONTEXT are not handed
+            # out, the pooled ones keep the old context alive, so its id
+            # can't be reused meanwhile
+            key = (conn_type, host, port, id(ssl_context))
+            conn = _pool_get(key, timeout)
+            if conn is not None:
+                return key, conn
+
+        kwargs = {"timeout": timeout, "source_address": source_address}
 
-        if conn_type == "http":
+        if ssl_context is None:
             conn = HTTPConnection(host, port, **kwargs)
-        elif conn_type == "https":
-            conn = HTTPSConnection(host, port, context=ssl_context, **kwargs)
         else:
-            raise URLError("Unknown Connection Type: %s" % conn_type)
-        return conn
+            conn = HTTPSConnection(host, port, context=ssl_context, **kwargs)
+        conn._create_connection = _create_connection
+        return key, conn
+
+    def send(conn):
+        """Send the request on conn, return the httplib response."""
+        request_url = url if via_proxy else parsed_url["uri"]
+        reused = conn.sock is not None
+        try:
+            conn.request(method, request_url, data, reqheaders)
+            return conn.getresponse()
+        except (ConnectionError, BadStatusLine):
+            # the request may have reached the server before the connection
+            # broke, only send it again if that does no harm
+            if (
+                not reused
+                or method not in IDEMPOTENT_METHODS
+                or not _rewindable(data)
+            ):
+                raise
+        # the server closed the idle connection meanwhile, try a new one
+        conn.close()
+        conn.request(method, request_url, data, reqheaders)
+        return conn.getresponse()
 
     via_proxy = False
 
     method = method.upper()
     if method not in ALLOWED_METHODS:
-        raise UrlfetchException("Method should be one of " + ", ".join(ALLOWED_METHODS))
+        raise UrlfetchException(
+            "Method should be one of " + ", ".join(sorted(ALLOWED_METHODS))
+        )
     if params:
         if isinstance(params, dict):
             url = url_concat(url, params)
@@ -653,12 +1015,11 @@ def request(
 
     parsed_url = parse_url(url)
 
-    reqheaders = {
-        "Accept": "*/*",
-        "Accept-Encoding": "gzip, deflate, compress, identity, *",
-        "User-Agent": random_useragent(randua),
-        "Host": parsed_url["http_host"],
-    }
+    reqheaders = DEFAULT_HEADERS.copy()
+    reqheaders["User-Agent"] = (
+        random_useragent(randua) if randua else DEFAULT_USERAGENT
+    )
+    reqheaders["Host"] = parsed_url["http_host"]
 
     # Proxy support
     scheme = parsed_url["scheme"]
@@ -683,14 +1044,14 @@ def request(
         parsed_proxy = parse_url(proxy)
         # Proxy-Authorization
         if parsed_proxy["username"] and parsed_proxy["password"]:
-            proxyauth = "%s:%s" % (parsed_proxy["username"], parsed_proxy["password"])
-            proxyauth = base64.b64encode(proxyauth.encode("utf-8"))
-            reqheaders["Proxy-Authorization"] = "Basic " + proxyauth.decode("utf-8")
-        conn = make_connection(
+            reqheaders["Proxy-Authorization"] = _basic_auth(
+                "%s:%s" % (parsed_proxy["username"], parsed_proxy["password"])
+            )
+        conn_key, conn = make_connection(
             parsed_proxy["scheme"], parsed_proxy["host"], parsed_proxy["port"], timeout, source_address
         )
     else:
-        conn = make_connection(
+        conn_key, conn = make_connection(
             scheme, parsed_url["host"], parsed_url["port"], timeout, source_address
         )
 
@@ -699,28 +1060,38 @@ def request(
     if auth:
         if isinstance(auth, (list, tuple)):
             auth = "%s:%s" % tuple(auth)
-        auth = base64.b64encode(auth.encode("utf-8"))
-        reqheaders["Authorization"] = "Basic " + auth.decode("utf-8")
+        reqheaders["Authorization"] = _basic_auth(auth)
 
     if files:
-        content_type, data = encode_multipart(data, files)
-        reqheaders["Content-Type"] = content_type
-    elif isinstance(data, dict):
-        data = urlencode(data, True)
-
-    if isinstance(data, basestring) and not files:
-        # httplib will set 'Content-Length', also you can set it by yourself
-        reqheaders["Content-Type"] = "application/x-www-form-urlencoded"
-        # what if the method is GET, HEAD or DELETE
-        # just do not make so much decisions for users
-
-    reqheaders.update(headers)
+        # sent as it is read, see MultipartBody
+        data = MultipartBody(data, files)
+        reqheaders["Content-Type"] = data.content_type
+        if data.length is not None:
+            reqheaders["Content-Length"] = str(data.length)
+        # else httplib sends it chunked, see MultipartBody._file_part()
+    else:
+        if isinstance(data, dict):
+            data = urlencode(data, True)
+        if isinstance(data, basestring) and not any(
+            # header names are case-insensitive, don't send two Content-Types
+            k.lower() == "content-type" for k in headers
+        ):
+            # httplib will set 'Content-Length', also you can set it by yourself
+            reqheaders["Content-Type"] = "application/x-www-form-urlencoded"
+            # what if the method is GET, HEAD or DELETE
+            # just do not make so much decisions for users
+
+    if headers:
+        # header names are case-insensitive, the caller's replace ours
+        # instead of being sent next to them
+        names = {k.lower() for k in headers}
+        for k in [k for k in reqheaders if k.lower() in names]:
+            del reqheaders[k]
+        reqheaders.update(headers)
 
     start_time = time.time()
     try:
-        request_url = url if via_proxy else parsed_url["uri"]
-        conn.request(method, request_url, data, reqheaders)
-        resp = conn.getresponse()
+        resp = send(conn)
     except socket.timeout as e:
         raise Timeout(e)
     except Exception as e:
@@ -733,14 +1104,16 @@ def request(
         resp,
         reqheaders=reqheaders,
         length_limit=length_limit,
+        decode_content=decode_content,
         history=history[:],
         url=url,
         total_time=total_time,
         start_time=start_time,
+        _connection=(conn_key, conn),
     )
 
     while (
-        response.status in (301, 302, 303, 307)
+        response.status in REDIRECT_CODES
         and "location" in response.headers
         and max_redirects
     ):
@@ -749,7 +1122,21 @@ def request(
         if len(history) > max_redirects:
             raise TooManyRedirects("max_redirects exceeded")
 
-        method = method if response.status == 307 else "GET"
+        if response.status == 307:
+            if not _rewindable(data):
+                raise UrlfetchException(
+                    "cannot resend streamed upload on redirect"
+                )
+        else:
+            # followed with a GET, without the body
+            method = "GET"
+            data = None
+            for k in [
+                k
+                for k in reqheaders
+                if k.lower() in ("content-type", "content-length")
+            ]:
+                del reqheaders[k]
         location = response.headers["location"]
         if location[:2] == "//":
             url = parsed_url["scheme"] + ":" + location
@@ -770,13 +1157,10 @@ def request(
             parsed_proxy = parse_url(proxy)
             # Proxy-Authorization
             if parsed_proxy["username"] and parsed_proxy["password"]:
-                proxyauth = "%s:%s" % (
-                    parsed_proxy["username"],
-                    parsed_proxy["username"],
+                reqheaders["Proxy-Authorization"] = _basic_auth(
+                    "%s:%s" % (parsed_proxy["username"], parsed_proxy["password"])
                 )
-                proxyauth = base64.b64encode(proxyauth.encode("utf-8"))
-                reqheaders["Proxy-Authorization"] = "Basic " + proxyauth.decode("utf-8")
-            conn = make_connection(
+            conn_key, conn = make_connection(
                 parsed_proxy["scheme"],
                 parsed_proxy["host"],
                 parsed_proxy["port"],
@@ -786,14 +1170,12 @@ def request(
         else:
             via_proxy = False
             reqheaders.pop("Proxy-Authorization", None)
-            conn = make_connection(
+            conn_key, conn = make_connection(
                 scheme, parsed_url["host"], parsed_url["port"], timeout, source_address
             )
 
         try:
-            request_url = url if via_proxy else parsed_url["uri"]
-            conn.request(method, request_url, data, reqheaders)
-            resp = conn.getresponse()
+            resp = send(conn)
         except socket.timeout as e:
             raise Timeout(e)
         except Exception as e:
@@ -803,10 +1185,12 @@ def request(
             resp,
             reqheaders=reqheaders,
             length_limit=length_limit,
+            decode_content=decode_content,
             history=history[:],
             url=url,
             total_time=total_time,
             start_time=start_time,
+            _connection=(conn_key, conn),
         )
 
     return response
@@ -850,6 +1234,13 @@ class ObjectDict(dict):
         self[name] = value
 
 
+@lru_cache(maxsize=256)
+def _idna_host(hostname):
+    """Returns ``hostname`` encoded with IDNA, cached as the same few hosts
+    are usually requested over and over."""
+    return hostname.encode("idna").decode("utf-8")
+
+
 def parse_url(url):
     """Return a dictionary of parsed url
 
@@ -861,6 +1252,14 @@ def parse_url(url):
     except UnicodeDecodeError:
         pass
 
+    # a copy, callers are free to change it
+    return ObjectDict(_parse_url(url))
+
+
+@lru_cache(maxsize=256)
+def _parse_url(url):
+    """Does the actual work of :func:`parse_url`, cached as the same URLs are
+    often requested over and over."""
     if "://" in url:
         scheme, url = url.split("://", 1)
     else:
@@ -878,16 +1277,22 @@ def parse_url(url):
         r["uri"] += "?" + parsed.query
     r["username"] = parsed.username
     r["password"] = parsed.password
-    host = parsed.hostname.encode("idna").decode("utf-8")
+    host = parsed.hostname
+    if ":" in host:
+        # IPv6 address, brackets are stripped by urlsplit but required in
+        # the Host header
+        http_host = "[%s]" % host
+    else:
+        host = http_host = _idna_host(host)
     r["host"] = r["hostname"] = host
     try:
         r["port"] = parsed.port
     except ValueError:
         r["port"] = None
     if r["port"]:
-        r["http_host"] = "%s:%d" % (r["host"], r["port"])
+        r["http_host"] = "%s:%d" % (http_host, r["port"])
     else:
-        r["http_host"] = r["host"]
+        r["http_host"] = http_host
 
     return r
 
@@ -905,31 +1310,168 @@ def get_proxies_from_environ():
 
 
 def mb_code(s, coding=None, errors="replace"):
-    """encoding/decoding helper."""
+    """encoding/decoding helper.
+
+    Bytes are decoded with the codec their BOM tells, or else with the
+    first of ``MB_CODINGS`` that can, falling back to ``latin-1``.
+    ``errors`` applies to encoding to ``coding``.
+    """
     if isinstance(s, str):
         return s if coding is None else s.encode(coding, errors=errors)
-    for c in ("utf-8", "gb2312", "gbk", "gb18030", "big5"):
-        try:
-            s = s.decode(c)
-            return s if coding is None else s.encode(coding, errors=errors)
-        except:
-            pass
-
-    return str(s, errors=errors)
 
+    codings = MB_CODINGS
+    for bom, c in BOMS:
+        if s.startswith(bom):
+            # a BOM tells the encoding, and must not end up in the result
+            codings = (c,)
+            break
 
-def random_useragent(filename=True):
-    """Returns a User-Agent string randomly from file.
-
-    :arg string filename: (Optional) Path to the file from which a random
-        useragent is generated. By default it's ``True``, a file shipped
-        with this module will be used.
-    :returns: An user-agent string.
+    for c in codings:
+        try:
+            text = s.decode(c)
+        except UnicodeDecodeError:
+            continue
+        return text if coding is None else text.encode(coding, errors=errors)
+
+    # ISO-8859-1 is the historical default charset of HTTP, it maps every
+    # byte, so nothing is lost
+    text = s.decode("latin-1")
+    return text if coding is None else text.encode(coding, errors=errors)
+
+
+class _UserAgents(object):
+    """A read-only sequence of user-agents, front coded.
+
+    Frequent tokens in user-agents, such as ``KHTML, like Gecko``, are
+    first replaced with single control bytes, which never appear in header
+    values.
+
+    User-agents are then sorted and split into blocks of :attr:`BLOCK`
+    entries. The first entry of a block is stored in full, the following
+    ones only as the length of the prefix shared with the previous entry
+    plus the remaining suffix. Sorted user-agents share long prefixes, so
+    less than a third of the original bytes are kept, while any entry can
+    still be rebuilt from no more than :attr:`BLOCK` pieces.
+
+    All pieces are stored back to back in a single bytes object, the start
+    of each one is recorded in an array of offsets. Blocks are decoded
+    whole on first lookup, and up to :attr:`CACHED_BLOCKS` of them, enough
+    for the shipped list, are kept decoded.
     """
-    import random
 
-    default_ua = "urlfetch/%s" % __version__
+    BLOCK = 16
+    CACHED_BLOCKS = 128
+
+    TOKENS = (
+        b"KHTML, like Gecko",
+        b"Mozilla/5.0 ",
+        b"AppleWebKit/",
+        b".NET CLR ",
+        b"Windows NT ",
+        b"Macintosh; Intel Mac OS X ",
+        b"compatible; MSIE ",
+        b"en-US",
+        b"Gecko/",
+        b"Safari/",
+        b"Chrome/",
+        b"Firefox/",
+        b"Version/",
+        b"Linux",
+        b"Presto/",
+        b"Opera/",
+    )
 
+    def __init__(self, useragents):
+        useragents = list(useragents)
+        # control bytes from 0x0e up, clear of \t, \n and \r
+        tokens = [(bytes([0x0E + i]), t) for i, t in enumerate(self.TOKENS)]
+        raw = b"\n".join(useragents)
+        if any(code in raw for code, token in tokens):
+            # not a sane user-agents file, keep it as is
+            tokens = []
+        for code, token in tokens:
+            useragents = [ua.replace(token, code) for ua in useragents]
+
+        pieces = []
+        offsets = array("I", [0])
+        prefixes = array("I")
+        previous = b""
+        for i, ua in enumerate(sorted(useragents)):
+            if i % self.BLOCK:
+                n = len(os.path.commonprefix((previous, ua)))
+            else:
+                n = 0
+            pieces.append(ua[n:])
+            offsets.append(offsets[-1] + len(ua) - n)
+            prefixes.append(n)
+            previous = ua
+        #: All pieces concatenated.
+        self.buffer = b"".join(pieces)
+        #: Offset of each piece in :attr:`buffer`, plus the end offset.
+        self.offsets = offsets
+        #: Length of prefix each entry shares with the previous one.
+        self.prefixes = prefixes
+        #: Pairs of (control byte, token) used in :attr:`buffer`.
+        self.tokens = tuple(tokens)
+        self._families = None
+        self._block = lru_cache(self.CACHED_BLOCKS)(self._decode_block)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __getitem__(self, i):
+        n = len(self.prefixes)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("user-agent index out of range")
+        return self._block(i // self.BLOCK)[i % self.BLOCK]
+
+    def _decode_block(self, k):
+        """Returns the entries of the ``k``-th block as a tuple."""
+        buffer, offsets, prefixes = self.buffer, self.offsets, self.prefixes
+        start = k * self.BLOCK
+        end = min(start + self.BLOCK, len(prefixes))
+        ua = buffer[offsets[start]:offsets[start + 1]]
+        entries = [ua]
+        for j in range(start + 1, end):
+            ua = ua[:prefixes[j]] + buffer[offsets[j]:offsets[j + 1]]
+            entries.append(ua)
+        # tokens expanded in the whole block at once, a C level pass per
+        # token being much faster than re.sub() calling back for each code;
+        # entries never contain a line break
+        block = b"\n".join(entries)
+        for code, token in self.tokens:
+            block = block.replace(code, token)
+        return tuple(block.split(b"\n"))
+
+    def family(self, name):
+        """Returns an array of the indices of the entries of browser family
+        ``name``, see :data:`UA_FAMILIES`, or ``None`` for unknown families.
+
+        All entries are classified on first call, in a single pass.
+        """
+        families = self._families
+        if families is None:
+            families = {f: array("I") for f, markers in UA_FAMILIES}
+            for i in range(len(self)):
+                ua = self[i]
+                for f, markers in UA_FAMILIES:
+                    if any(m in ua for m in markers):
+                        families[f].append(i)
+                        break
+            self._families = families
+        return families.get(name)
+
+
+def _find_useragents_file(filename=True):
+    """Returns the path of the first readable user-agents file.
+
+    :arg string filename: (Optional) Path to the file to check before the
+        one shipped with this module. ``False`` or ``None`` disables the
+        lookup entirely.
+    :returns: A path, or ``None`` if no usable file is found.
+    """
     if isinstance(filename, basestring):
         filenames = [filename]
     else:
@@ -942,39 +1484,119 @@ def random_useragent(filename=True):
         try:
             st = os.stat(filename)
             if stat.S_ISREG(st.st_mode) and os.access(filename, os.R_OK):
-                break
+                return filename
         except:
             pass
-    else:
-        return default_ua
+    return None
+
+
+def _load_useragents(filename=True):
+    """Returns user-agents in the file :func:`_find_useragents_file` finds
+    for ``filename`` as a :class:`_UserAgents`, blank lines and comments
+    skipped, or ``None`` if there is no such file.
+
+    Tables are cached by ``filename``, so the lookup and the read happen
+    only once. Files whose name ends with ``.gz`` are decompressed
+    transparently.
+    """
+    if not filename:
+        return None
+    if not isinstance(filename, basestring):
+        filename = True
 
-    with open(filename, "rb") as f:
-        filesize = st.st_size
-        pos = 0
-        r = random.Random()
+    try:
+        return USERAGENTS_CACHE[filename]
+    except KeyError:
+        pass
 
-        # try getting a valid line for no more than 3 times
-        for i in range(3):
+    path = _find_useragents_file(filename)
+    if path is None:
+        return None
 
-            pos += r.randint(0, filesize)
-            pos %= filesize
-            f.seek(pos)
+    useragents = USERAGENTS_CACHE.get(path)
+    if useragents is None:
+        if path.endswith(".gz"):
+            opener = gzip.open
+        else:
+            opener = open
 
-            # in case we are in middle of a line
-            f.readline()
+        with opener(path, "rb") as f:
+            lines = (i.strip() for i in f)
+            # duplicated lines would be picked more often than the others
+            useragents = _UserAgents(dict.fromkeys(
+                line for line in lines if line and line[:1] != b"#"
+            ))
+        USERAGENTS_CACHE[path] = useragents
 
-            line = f.readline()
-            if not line:
-                if f.tell() == filesize:
-                    # end of file
-                    f.seek(0)
-                    line = f.readline()
+    USERAGENTS_CACHE[filename] = useragents
+    return useragents
 
-            line = line.strip()
-            if line and line[0] != "#":
-                return line
 
-    return default_ua
+def random_useragent(filename=True, sticky=False, family=None):
+    """Returns a User-Agent string randomly from file.
+
+    The file is loaded on first use and kept in memory as a single packed
+    buffer. Pre-forking servers and crawlers can call this once before
+    forking, so that all workers share the loaded pages copy-on-write
+    instead of each loading its own copy.
+
+    :arg string filename: (Optional) Path to the file from which a random
+        useragent is generated. By default it's ``True``, a file shipped
+        with this module will be used. The file may be gzip compressed, in
+        which case its name must end with ``.gz``.
+    :arg bool sticky: (Optional) If ``True``, the user-agent picked by the
+        first sticky call in current thread is returned again by all later
+        sticky calls in that thread with the same ``filename`` and
+        ``family``.
+    :arg string family: (Optional) Only pick user-agents of this browser
+        family, one of the names in :data:`UA_FAMILIES`, e.g. ``"Chrome"``.
+        If the file has no such user-agent, any one is picked.
+    :returns: An user-agent string. User-agents picked from file are
+        ``bytes``, ready to be sent as header value without encoding; the
+        ``'urlfetch/' + __version__`` fallback is a ``str``.
+    """
+    if sticky:
+        try:
+            picked = THREAD_LOCAL.useragents
+        except AttributeError:
+            picked = THREAD_LOCAL.useragents = {}
+        key = (filename, family)
+        ua = picked.get(key)
+        if ua is None:
+            ua = picked[key] = random_useragent(filename, family=family)
+        return ua
+
+    useragents = _load_useragents(filename)
+    if not useragents:
+        return DEFAULT_USERAGENT
+    indices = family and useragents.family(family)
+    if indices:
+        return useragents[indices[int(RANDOM.random() * len(indices))]]
+    return useragents[int(RANDOM.random() * len(useragents))]
+
+
+def random_useragents(n, filename=True, family=None):
+    """Returns ``n`` User-Agent strings randomly from file.
+
+    Much cheaper than calling :func:`random_useragent` ``n`` times, the file
+    is looked up and loaded only once for the whole batch.
+
+    :arg int n: Number of user-agents wanted.
+    :arg string filename: (Optional) Same as in :func:`random_useragent`.
+    :arg string family: (Optional) Same as in :func:`random_useragent`.
+    :returns: A list of user-agent strings.
+    """
+    useragents = _load_useragents(filename)
+    if not useragents:
+        return [DEFAULT_USERAGENT] * n
+
+    rand = RANDOM.random
+    indices = family and useragents.family(family)
+    if indices:
+        total = len(indices)
+        return [useragents[indices[int(rand() * total)]] for i in range(n)]
+    total = len(useragents)
+    return [useragents[int(rand() * total)] for i in range(n)]
 
 
 def url_concat(url, args, keep_existing=True):
@@ -1007,105 +1629,271 @@ def choose_boundary():
 
     :returns: A boundary string
     """
-    global BOUNDARY_PREFIX
-    if BOUNDARY_PREFIX is None:
-        BOUNDARY_PREFIX = "urlfetch"
-        try:
-            uid = repr(os.getuid())
-            BOUNDARY_PREFIX += "." + uid
-        except AttributeError:
-            pass
-        try:
-            pid = repr(os.getpid())
-            BOUNDARY_PREFIX += "." + pid
-        except AttributeError:
-            pass
+    return "%s.%s" % (BOUNDARY_PREFIX, os.urandom(16).hex())
 
-    return "%s.%s" % (BOUNDARY_PREFIX, uuid.uuid4().hex)
 
+class MultipartBody(object):
+    """A multipart/form-data body, iterated piece by piece.
 
-def encode_multipart(data, files):
-    """Encode multipart.
+    Files are not read up front, but in chunks while the body is iterated
+    over, so uploading a large file doesn't load it into memory.
+
+    Seekable binary files are rewound on each iteration, so the body can be
+    sent again, e.g. after a 307 redirect, and its :attr:`length` is known.
+    Text files are read up front and encoded to UTF-8. Other binary streams,
+    like pipes or sockets, are read to their end once, so :attr:`length` is
+    ``None`` and the body is sent with chunked ``Transfer-Encoding``; before
+    Python 3.6, which can't send it so, they are read up front too.
 
     :arg dict data: Data to be encoded
     :arg dict files: Files to be encoded
-    :returns: Encoded binary string
     :raises: :class:`UrlfetchException`
     """
-    body = BytesIO()
-    boundary = choose_boundary()
-    part_boundary = b("--%s\r\n" % boundary)
-    writer = codecs.lookup("utf-8")[3]
-
-    if isinstance(data, dict):
-        for name, values in data.items():
-            if not isinstance(values, (list, tuple, set)):
-                # behave like urllib.urlencode(dict, True)
-                values = (values,)
-            for value in values:
-                body.write(part_boundary)
-                writer(body).write(
-                    "Content-Disposition: form-data; " 'name="%s"\r\n' % name
-                )
-                body.write(b"Content-Type: text/plain\r\n\r\n")
-                if isinstance(value, int):
-                    value = str(value)
-                if isinstance(value, str):
-                    writer(body).write(value)
-                else:
-                    body.write(value)
-                body.write(b"\r\n")
-
-    for fieldname, f in files.items():
-        if isinstance(f, tuple):
-            filename, f = f
-        elif hasattr(f, "name"):
-            filename = basename(f.name)
-        else:
-            filename = None
-            raise UrlfetchException("file must has filename")
 
-        if hasattr(f, "read"):
-            value = f.read()
-        elif isinstance(f, basestring):
-            value = f
-        else:
-            value = str(f)
+    #: Size of chunks files are read in.
+    chunk_size = 65536
+
+    def __init__(self, data, files):
+        #: Boundary between parts.
+        self.boundary = boundary = choose_boundary()
+        #: Value of the ``Content-Type`` header to send along.
+        self.content_type = "multipart/form-data; boundary=%s" % boundary
+        part_boundary = b("--%s\r\n" % boundary)
+
+        parts = []
+        if isinstance(data, dict):
+            for name, values in data.items():
+                if not isinstance(values, (list, tuple, set)):
+                    # behave like urllib.urlencode(dict, True)
+                    values = (values,)
+                headers = (
+                    'Content-Disposition: form-data; name="%s"\r\n'
+                    "Content-Type: text/plain\r\n\r\n"
+                    % str(name).translate(FORMDATA_ESCAPE)
+                ).encode("utf-8")
+                for value in values:
+                    parts.append(part_boundary)
+                    parts.append(headers)
+                    if isinstance(value, int):
+                        value = str(value)
+                    if isinstance(value, str):
+                        value = value.encode("utf-8")
+                    parts.append(value)
+                    parts.append(b"\r\n")
+
+        for fieldname, f in files.items():
+            if isinstance(f, tuple):
+                filename, f = f
+            elif hasattr(f, "name"):
+                filename = basename(f.name)
+            else:
+                filename = None
+                raise UrlfetchException("file must has filename")
 
-        body.write(part_boundary)
-        if filename:
-            writer(body).write(
-                'Content-Disposition: form-data; name="%s"; '
-                'filename="%s"\r\n' % (fieldname, filename)
-            )
-            body.write(b"Content-Type: application/octet-stream\r\n\r\n")
-        else:
-            writer(body).write(
-                'Content-Disposition: form-data; name="%s"' "\r\n" % fieldname
-            )
-            body.write(b"Content-Type: text/plain\r\n\r\n")
+            if hasattr(f, "read"):
+                value = self._file_part(f)
+            elif isinstance(f, basestring):
+                value = f
+            else:
+                value = str(f)
+
+            fieldname = str(fieldname).translate(FORMDATA_ESCAPE)
+            parts.append(part_boundary)
+            if filename:
+                filename = str(filename).translate(FORMDATA_ESCAPE)
+                parts.append(
+                    (
+                        'Content-Disposition: form-data; name="%s"; '
+                        'filename="%s"\r\n' % (fieldname, filename)
+                    ).encode("utf-8")
+                )
+                parts.append(b"Content-Type: application/octet-stream\r\n\r\n")
+            else:
+                parts.append(
+                    (
+                        'Content-Disposition: form-data; name="%s"'
+                        "\r\n" % fieldname
+                    ).encode("utf-8")
+                )
+                parts.append(b"Content-Type: text/plain\r\n\r\n")
+
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            parts.append(value)
+            parts.append(b"\r\n")
+
+        parts.append(b("--" + boundary + "--\r\n"))
+
+        #: Pieces of the body, either bytes or ``(file, start, size)``
+        #: tuples, ``start`` and ``size`` are ``None`` for files read to
+        #: their end. Runs of bytes are joined, so that each is sent at once
+        #: instead of in a number of tiny writes.
+        self.parts = []
+        for is_file, group in groupby(parts, lambda part: isinstance(part, tuple)):
+            if is_file:
+                self.parts.extend(group)
+            else:
+                self.parts.append(b"".join(group))
+        #: Total size of the body in bytes, or ``None`` if unknown.
+        self.length = 0
+        for part in self.parts:
+            size = part[2] if isinstance(part, tuple) else len(part)
+            if size is None:
+                self.length = None
+                break
+            self.length += size
+        #: Whether the body can be iterated over, i.e. sent, more than once.
+        #: Streams of unknown size are read to their end the first time.
+        self.rewindable = self.length is not None
+
+    @staticmethod
+    def _file_part(f):
+        """Returns ``(f, start, size)`` for seekable binary files,
+        ``(f, None, None)`` for other binary streams, or the whole content of
+        ``f`` for text files and files that can't be read in chunks, or sent
+        chunked."""
+        try:
+            probe = f.read(0)
+        except TypeError:
+            return f.read()
+        if not isinstance(probe, bytes):
+            # text, its encoded size is only known once read
+            return f.read()
+        try:
+            start = f.tell()
+            end = f.seek(0, 2)
+            f.seek(start)
+            return (f, start, end - start)
+        except (AttributeError, OSError, ValueError):
+            if sys.version_info < (3, 6):
+                # no chunked Transfer-Encoding in httplib before 3.6
+                return f.read()
+            return (f, None, None)
 
-        if isinstance(value, str):
-            writer(body).write(value)
-        else:
-            body.write(value)
-        body.write(b"\r\n")
+    def __iter__(self):
+        chunk_size = self.chunk_size
+        for part in self.parts:
+            if not isinstance(part, tuple):
+                yield part
+                continue
+            f, start, size = part
+            if start is None:
+                chunk = f.read(chunk_size)
+                while chunk:
+                    yield chunk
+                    chunk = f.read(chunk_size)
+                continue
+            f.seek(start)
+            while size > 0:
+                chunk = f.read(min(size, chunk_size))
+                if not chunk:
+                    # shrunk since, the Content-Length sent would be wrong
+                    raise UrlfetchException(
+                        "file ended %d bytes short of its size" % size
+                    )
+                size -= len(chunk)
+                yield chunk
+
+    def getvalue(self):
+        """Returns the whole body as bytes."""
+        return b"".join(self)
 
-    body.write(b("--" + boundary + "--\r\n"))
 
-    content_type = "multipart/form-data; boundary=%s" % boundary
+def encode_multipart(data, files):
+    """Encode multipart.
 
-    return content_type, body.getvalue()
+    :arg dict data: Data to be encoded
+    :arg dict files: Files to be encoded
+    :returns: Encoded binary string
+    :raises: :class:`UrlfetchException`
+    """
+    body = MultipartBody(data, files)
+    return body.content_type, body.getvalue()
 
 
 ##############################################################################
 # Constants and Globals #######################################################
 ##############################################################################
 
-ALLOWED_METHODS = (GET, DELETE, HEAD, OPTIONS, PUT, POST, TRACE, PATCH)
+ALLOWED_METHODS = frozenset((GET, DELETE, HEAD, OPTIONS, PUT, POST, TRACE, PATCH))
 PROXY_IGNORE_HOSTS = ("127.0.0.1", "localhost")
 PROXIES = get_proxies_from_environ()
-BOUNDARY_PREFIX = None
+# methods safe to send twice, see send() in request()
+IDEMPOTENT_METHODS = frozenset((GET, HEAD, PUT, DELETE, OPTIONS, TRACE))
+REDIRECT_CODES = frozenset((301, 302, 303, 307))
+# name=value pairs starting (possibly folded) Set-Cookie headers: headers
+# are only split on commas followed by name=, never the case of commas in
+# Expires dates or in values
+SET_COOKIE_REGEX = re.compile(
+    r"(?:^|,(?=\s*[^=;,\s]+=))\s*([^=;,\s]+)=([^;]*?)(?=;|,\s*[^=;,\s]+=|$)"
+)
+# charset parameter of a Content-Type header
+CHARSET_REGEX = re.compile(r"""charset\s*=\s*["']?([\w.:-]+)""", re.I)
+#: User-Agent sent when ``randua`` is not given or no user-agents file is
+#: found.
+DEFAULT_USERAGENT = "urlfetch/%s" % __version__
+#: Headers sent with every request, unless overridden.
+DEFAULT_HEADERS = {
+    "Accept": "*/*",
+    # only what Response can decompress, anything else would end in a
+    # ContentDecodingError
+    "Accept-Encoding": "gzip, deflate",
+}
+BOUNDARY_PREFIX = "urlfetch"
+if hasattr(os, "getuid"):
+    BOUNDARY_PREFIX += ".%d" % os.getuid()
+BOUNDARY_PREFIX += ".%d" % os.getpid()
+# escaping of field names and filenames in multipart/form-data, as browsers
+# do, a quote or a line break would otherwise end the header
+FORMDATA_ESCAPE = str.maketrans({'"': "%22", "\r": "%0D", "\n": "%0A"})
+# tried in turn by mb_code()
+MB_CODINGS = ("utf-8", "gb18030", "big5")
+# utf-32 BOMs start with utf-16 ones, so they must be checked first
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+USERAGENTS_CACHE = {}
+#: Idle connections as (idle since, connection) by (scheme, host, port,
+#: SSL context id), least recently used hosts first, see :func:`close_all`.
+CONNECTION_POOL = OrderedDict()
+POOL_LOCK = threading.Lock()
+#: Max idle connections kept per host.
+POOL_MAXSIZE = 10
+#: Seconds after which an idle connection is not reused any more.
+POOL_IDLE_TIMEOUT = 5
+#: Max hosts idle connections are kept for, the least recently used ones
+#: are closed beyond.
+POOL_MAX_HOSTS = 100
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_pool_after_fork)
+#: Resolved addresses as (resolved at, getaddrinfo() results) by (host,
+#: port).
+DNS_CACHE = {}
+#: Seconds resolved addresses are reused for, ``0`` disables the cache.
+DNS_CACHE_TTL = 60
+#: Max hosts kept in :data:`DNS_CACHE`, it is emptied when full.
+DNS_CACHE_MAXSIZE = 256
+#: :class:`ssl.SSLContext` used for HTTPS, created on first use. Set it to
+#: use a context of your own.
+SSL_CONTEXT = None
+UNVERIFIED_SSL_CONTEXT = None
+#: Browser families known to :func:`random_useragent`, with the markers
+#: identifying them, in the order they are tried.
+UA_FAMILIES = (
+    ("Edge", (b"Edg/", b"Edge/")),
+    ("Opera", (b"OPR/", b"Opera")),
+    ("Chrome", (b"Chrome/", b"CriOS/")),
+    ("Firefox", (b"Firefox/",)),
+    ("MSIE", (b"MSIE ", b"Trident/")),
+    ("Safari", (b"Safari/",)),
+)
+THREAD_LOCAL = threading.local()
+# not affected by random.seed() calls of the application
+RANDOM = random.Random()
 
 UAFILENAME = "urlfetch.useragents.list"
 UAFILE = next(